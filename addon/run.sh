@@ -682,7 +682,10 @@ run_tunnel() {
 start_webapp() {
     bashio::log.info "Starting setup web UI on port 8099..."
     cd /webapp
-    gunicorn --bind 0.0.0.0:8099 --workers 1 --threads 2 --timeout 30 app:app &
+    # One worker: deploy progress, the deploy lock and the JSON caches live
+    # in-process. Threads keep /health and status polls from queueing
+    # behind the entity list or a deploy request.
+    gunicorn --bind 0.0.0.0:8099 --worker-class gthread --workers 1 --threads 8 --timeout 30 app:app &
     webapp_pid=$!
     bashio::log.info "Web UI started (pid: $webapp_pid)"
 }
@@ -6,23 +6,66 @@ Uses service account authentication - fully self-contained in user's project.
 """
 
 import os
-import json
+import copy
 import secrets
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
 from pathlib import Path
 
 from flask import Flask, render_template, request, jsonify
+from flask.json.provider import JSONProvider
 import requests
+import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from google.oauth2 import service_account
+from google.auth.exceptions import TransportError
 from google.auth.transport.requests import Request
 
+# orjson when it's installed; some add-on arches (armhf) have no wheel for
+# it, so fall back to the stdlib. json_dumps returns compact bytes either way.
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+    JSONDecodeError = orjson.JSONDecodeError
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(obj):
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+    JSONDecodeError = ValueError  # also covers bytes that aren't UTF-8
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider using json_dumps/json_loads, for jsonify() and request.json."""
+
+    def dumps(self, obj, **kwargs):
+        return json_dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return json_loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(json_dumps(obj), mimetype="application/json")
+
+
 app = Flask(__name__)
+app.json = FastJSONProvider(app)
 app.secret_key = secrets.token_hex(32)
 
 # Paths
 DATA_DIR = Path("/data")
 SA_KEY_FILE = DATA_DIR / "service_account.json"
 SETUP_FILE = DATA_DIR / "setup_state.json"
+DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 # Pre-built tunnel server image
 TUNNEL_IMAGE = "ghcr.io/bramalkema/ha-edge/server:latest"
@@ -30,6 +73,50 @@ TUNNEL_IMAGE = "ghcr.io/bramalkema/ha-edge/server:latest"
 # Required scopes
 SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
 
+# Supervisor API access (token is fixed for the add-on's lifetime).
+# SUPERVISOR_HEADERS is shared - don't modify it.
+SUPERVISOR_URL = "http://supervisor"
+SUPERVISOR_TOKEN = os.environ.get("SUPERVISOR_TOKEN")
+SUPERVISOR_HEADERS = {"Authorization": f"Bearer {SUPERVISOR_TOKEN}"}
+
+# Deploys run one at a time in the background; the UI polls /api/status
+deploy_executor = ThreadPoolExecutor(max_workers=1)
+_deploy_future = None
+_deploy_lock = threading.Lock()
+
+# Last /api/status body and the inputs it was built from
+_status_snapshot = (None, None)
+
+# Parsed JSON files: {path: (mtime_ns, data)}. Re-parsed only when the
+# file's mtime changes; our own writes update the entry directly.
+_json_cache = {}
+
+# Parsed service account credentials, reused until the key file changes
+_credentials = None
+_credentials_mtime = None
+_credentials_lock = threading.Lock()
+
+# Shared HTTP session for GCP, OAuth token and Supervisor calls:
+# connections are kept alive, so a deploy's sequence of googleapis.com calls
+# pays one TLS handshake per host (one pool per host, ~5 hosts; urllib3
+# already sets TCP_NODELAY). Transient errors are retried with backoff (urllib3
+# only retries idempotent methods on status codes, never POST). Auth
+# headers are per call, so the GCP token never goes to the Supervisor.
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    # raise_on_status=False: once retries run out, return the last response
+    # (callers check status_code) rather than raising RetryError
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504],
+                      raise_on_status=False),
+)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
+
+# Token refresh transport, on the shared session
+_auth_request = Request(session=SESSION)
+
 
 def get_ingress_path():
     """Get the ingress base path from environment."""
@@ -47,33 +134,104 @@ def generate_password():
     return secrets.token_urlsafe(24)
 
 
+def load_json_cached(path):
+    """Load a JSON file, reusing the last parse while its mtime is unchanged.
+
+    Returns None if the file doesn't exist. The returned object is shared
+    between requests - callers must not mutate it.
+    """
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        _json_cache.pop(path, None)
+        return None
+
+    cached = _json_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    data = json_loads(path.read_bytes())
+    _json_cache[path] = (mtime, data)
+    return data
+
+
+def write_json_cached(path, data, raw=None, mode=None):
+    """Atomically write a JSON file and record what was written in the cache.
+
+    raw, if given, is the already-serialized form of data and is written
+    as-is. mode, if given, is the file's permissions from the moment it is
+    created (subject to the umask).
+    """
+    # Write to a per-thread temp file and rename, so readers never see a
+    # partially written file. A leftover temp file from a crash is removed
+    # first so O_EXCL creates it fresh with our mode.
+    tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+    tmp.unlink(missing_ok=True)
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, mode if mode is not None else 0o644)
+    with os.fdopen(fd, "wb") as f:
+        f.write(raw if raw is not None else json_dumps(data))
+    os.replace(tmp, path)
+    # Copy, so later changes by the caller don't leak into the cache
+    _json_cache[path] = (path.stat().st_mtime_ns, copy.deepcopy(data))
+
+
+def get_sa_key_status():
+    """Return (has_key, project_id) for the uploaded service account key.
+
+    One stat via the JSON cache; an unreadable key counts as uploaded but
+    without a project ID.
+    """
+    try:
+        sa_data = load_json_cached(SA_KEY_FILE)
+    except Exception:
+        return True, None
+    if sa_data is None:
+        return False, None
+    return True, sa_data.get("project_id")
+
+
 def get_setup_state():
-    """Load setup state from file."""
-    if SETUP_FILE.exists():
-        return json.loads(SETUP_FILE.read_text())
+    """Load setup state from file (a copy the caller may modify)."""
+    state = load_json_cached(SETUP_FILE)
+    if state is not None:
+        return dict(state)
     return {"step": "start", "project_id": None, "password": None}
 
 
 def save_setup_state(state):
     """Save setup state to file."""
-    DATA_DIR.mkdir(exist_ok=True)
-    SETUP_FILE.write_text(json.dumps(state, indent=2))
+    write_json_cached(SETUP_FILE, state)
 
 
 def get_credentials():
-    """Load service account credentials."""
-    if not SA_KEY_FILE.exists():
-        return None
+    """Load service account credentials.
+
+    The parsed credentials (and their token) are cached; the key file is
+    only re-read when its mtime changes, e.g. after a new upload.
+    """
+    global _credentials, _credentials_mtime
 
     try:
-        creds = service_account.Credentials.from_service_account_file(
-            str(SA_KEY_FILE), scopes=SCOPES
-        )
-        return creds
-    except Exception as e:
-        print(f"Error loading credentials: {e}")
+        mtime = SA_KEY_FILE.stat().st_mtime_ns
+    except FileNotFoundError:
         return None
 
+    with _credentials_lock:
+        if _credentials is not None and mtime == _credentials_mtime:
+            return _credentials
+
+        try:
+            creds = service_account.Credentials.from_service_account_file(
+                str(SA_KEY_FILE), scopes=SCOPES
+            )
+        except Exception as e:
+            print(f"Error loading credentials: {e}")
+            return None
+
+        _credentials = creds
+        _credentials_mtime = mtime
+        return creds
+
 
 def get_access_token():
     """Get a valid access token."""
@@ -81,9 +239,11 @@ def get_access_token():
     if not creds:
         return None
 
-    # Refresh if needed
+    # Refresh if needed (once, even if several requests notice together)
     if not creds.valid:
-        creds.refresh(Request())
+        with _credentials_lock:
+            if not creds.valid:
+                creds.refresh(_auth_request)
 
     return creds.token
 
@@ -98,24 +258,78 @@ def gcp_api(method, url, **kwargs):
         "Authorization": f"Bearer {token}",
         "Content-Type": "application/json",
     }
-    resp = requests.request(method, url, headers=headers, **kwargs)
+    resp = SESSION.request(method, url, headers=headers, **kwargs)
     return resp
 
 
+def enable_api(project_id, api):
+    """Enable a GCP API on the project."""
+    return gcp_api("POST",
+        f"https://serviceusage.googleapis.com/v1/projects/{project_id}/services/{api}:enable")
+
+
+# Errors that make a readiness check count as "not ready yet" rather than
+# failing the deploy
+CHECK_ERRORS = (requests.RequestException, JSONDecodeError, TransportError)
+
+
+def api_enabled(project_id, api):
+    """Check whether a GCP API is enabled on the project."""
+    try:
+        resp = gcp_api("GET",
+            f"https://serviceusage.googleapis.com/v1/projects/{project_id}/services/{api}")
+        return bool(resp and resp.status_code == 200 and json_loads(resp.content).get("state") == "ENABLED")
+    except CHECK_ERRORS:
+        return False
+
+
+def service_settled(project_id, region, service_name):
+    """Check whether Cloud Run has finished rolling out the latest service spec.
+
+    True once the current generation is Ready; raises RuntimeError if the
+    rollout failed.
+    """
+    try:
+        resp = gcp_api("GET",
+            f"https://run.googleapis.com/v1/projects/{project_id}/locations/{region}/services/{service_name}")
+        if not resp or resp.status_code != 200:
+            return False
+        service = json_loads(resp.content)
+    except CHECK_ERRORS:
+        return False
+
+    status = service.get("status", {})
+    if status.get("observedGeneration") != service.get("metadata", {}).get("generation"):
+        return False
+    for condition in status.get("conditions", []):
+        if condition.get("type") == "Ready":
+            if condition.get("status") == "False":
+                raise RuntimeError(f"Cloud Run deploy failed: {condition.get('message') or 'service not ready'}")
+            return condition.get("status") == "True"
+    return False
+
+
+def poll_until(check, timeout, interval=0.5, max_interval=4):
+    """Call check() with exponential backoff until it returns True.
+
+    Gives up after roughly timeout seconds; returns whether check passed.
+    """
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() + interval > deadline:
+            return False
+        time.sleep(interval)
+        interval = min(interval * 2, max_interval)
+    return True
+
+
 @app.route("/")
 def index():
     """Main page - shows setup wizard or status."""
     state = get_setup_state()
-    has_key = SA_KEY_FILE.exists()
 
     # Get project ID from service account if available
-    project_id = None
-    if has_key:
-        try:
-            sa_data = json.loads(SA_KEY_FILE.read_text())
-            project_id = sa_data.get("project_id")
-        except:
-            pass
+    has_key, project_id = get_sa_key_status()
 
     return render_template("index.html",
                          state=state,
@@ -136,16 +350,16 @@ def upload_key():
     try:
         # Handle both file upload and JSON paste
         if request.files.get("keyfile"):
-            key_data = request.files["keyfile"].read().decode("utf-8")
+            key_data = request.files["keyfile"].read()
         elif request.json and request.json.get("key"):
-            key_data = request.json["key"]
+            key_data = request.json["key"].encode("utf-8")
         else:
             return jsonify({"error": "No key provided"}), 400
 
         # Validate JSON
         try:
-            key_json = json.loads(key_data)
-        except json.JSONDecodeError:
+            key_json = json_loads(key_data)
+        except JSONDecodeError:
             return jsonify({"error": "Invalid JSON"}), 400
 
         # Check required fields
@@ -157,10 +371,8 @@ def upload_key():
         if key_json.get("type") != "service_account":
             return jsonify({"error": "Not a service account key"}), 400
 
-        # Save key
-        DATA_DIR.mkdir(exist_ok=True)
-        SA_KEY_FILE.write_text(json.dumps(key_json, indent=2))
-        SA_KEY_FILE.chmod(0o600)
+        # Save the key exactly as uploaded
+        write_json_cached(SA_KEY_FILE, key_json, raw=key_data, mode=0o600)
 
         # Update state
         state = get_setup_state()
@@ -177,105 +389,138 @@ def upload_key():
         return jsonify({"error": str(e)}), 500
 
 
+# Cloud Run service for the tunnel server
+CLOUD_RUN_REGION = "us-central1"
+CLOUD_RUN_SERVICE = "ha-tunnel"
+
+# Knative service spec for the v1 Cloud Run API, serialized once. Only the
+# project and the tunnel credentials vary per deploy.
+_SERVICE_CONFIG_TEMPLATE = json_dumps({
+    "apiVersion": "serving.knative.dev/v1",
+    "kind": "Service",
+    "metadata": {
+        "name": CLOUD_RUN_SERVICE,
+        "namespace": "$PROJECT_ID",
+        "annotations": {
+            "run.googleapis.com/ingress": "all",
+            "run.googleapis.com/launch-stage": "BETA"
+        }
+    },
+    "spec": {
+        "template": {
+            "metadata": {
+                "annotations": {
+                    "autoscaling.knative.dev/minScale": "0",
+                    "autoscaling.knative.dev/maxScale": "1",
+                    "run.googleapis.com/cpu-throttling": "true"
+                }
+            },
+            "spec": {
+                "containerConcurrency": 80,
+                "timeoutSeconds": 3600,
+                "containers": [{
+                    "image": TUNNEL_IMAGE,
+                    "env": [
+                        {"name": "AUTH", "value": "$AUTH"}
+                    ],
+                    "resources": {
+                        "limits": {
+                            "cpu": "1",
+                            "memory": "256Mi"
+                        }
+                    },
+                    "ports": [{"containerPort": 8080}]
+                }]
+            }
+        }
+    }
+})
+
+
+def cloud_run_service_config(project_id, password):
+    """Request body for creating/replacing the tunnel service."""
+    return (_SERVICE_CONFIG_TEMPLATE
+            .replace(b'"$PROJECT_ID"', json_dumps(project_id))
+            .replace(b'"$AUTH"', json_dumps(f"hauser:{password}")))
+
+
 @app.route("/api/deploy", methods=["POST"])
 def run_deploy():
-    """Deploy Cloud Run using service account."""
+    """Start a Cloud Run deploy in the background; poll /api/status for progress."""
+    global _deploy_future
+
     if not SA_KEY_FILE.exists():
         return jsonify({"error": "No service account key uploaded"}), 400
 
-    state = get_setup_state()
-
     try:
-        sa_data = json.loads(SA_KEY_FILE.read_text())
-        project_id = sa_data["project_id"]
+        project_id = load_json_cached(SA_KEY_FILE)["project_id"]
     except Exception as e:
         return jsonify({"error": f"Invalid key file: {e}"}), 400
 
-    # Generate password
-    password = state.get("password") or generate_password()
-    state["password"] = password
-    state["project_id"] = project_id
+    with _deploy_lock:
+        if _deploy_future and not _deploy_future.done():
+            return jsonify({"error": "Deploy already in progress"}), 409
+
+        state = get_setup_state()
+
+        # Generate password
+        state["password"] = state.get("password") or generate_password()
+        state["project_id"] = project_id
+        state["step"] = "starting"
+        state.pop("error", None)
+        save_setup_state(state)
+
+        _deploy_future = deploy_executor.submit(deploy_worker, state)
+
+    return jsonify({"accepted": True, "project_id": project_id}), 202
+
+
+def deploy_worker(state):
+    """Run the deploy pipeline, recording progress and errors in setup state."""
+    project_id = state["project_id"]
+    password = state["password"]
 
     try:
         # Step 1: Enable APIs
         state["step"] = "enabling_apis"
         save_setup_state(state)
 
+        # Independent calls - enable all APIs in parallel
         apis = ["run.googleapis.com", "cloudbuild.googleapis.com"]
-        for api in apis:
-            resp = gcp_api("POST",
-                f"https://serviceusage.googleapis.com/v1/projects/{project_id}/services/{api}:enable")
+        with ThreadPoolExecutor(max_workers=len(apis)) as pool:
+            for api in apis:
+                pool.submit(enable_api, project_id, api)
             # Ignore errors - might already be enabled or just need time
 
-        # Wait for APIs to propagate
-        time.sleep(5)
+        # Wait for APIs to propagate (usually done well before the cap)
+        poll_until(lambda: all(api_enabled(project_id, api) for api in apis), timeout=15)
 
         # Step 2: Deploy Cloud Run
         state["step"] = "deploying"
         save_setup_state(state)
 
-        region = "us-central1"
-        service_name = "ha-tunnel"
+        region = CLOUD_RUN_REGION
+        service_name = CLOUD_RUN_SERVICE
 
-        # Use the v1 API for Cloud Run
-        service_config = {
-            "apiVersion": "serving.knative.dev/v1",
-            "kind": "Service",
-            "metadata": {
-                "name": service_name,
-                "namespace": project_id,
-                "annotations": {
-                    "run.googleapis.com/ingress": "all",
-                    "run.googleapis.com/launch-stage": "BETA"
-                }
-            },
-            "spec": {
-                "template": {
-                    "metadata": {
-                        "annotations": {
-                            "autoscaling.knative.dev/minScale": "0",
-                            "autoscaling.knative.dev/maxScale": "1",
-                            "run.googleapis.com/cpu-throttling": "true"
-                        }
-                    },
-                    "spec": {
-                        "containerConcurrency": 80,
-                        "timeoutSeconds": 3600,
-                        "containers": [{
-                            "image": TUNNEL_IMAGE,
-                            "env": [
-                                {"name": "AUTH", "value": f"hauser:{password}"}
-                            ],
-                            "resources": {
-                                "limits": {
-                                    "cpu": "1",
-                                    "memory": "256Mi"
-                                }
-                            },
-                            "ports": [{"containerPort": 8080}]
-                        }]
-                    }
-                }
-            }
-        }
+        service_config = cloud_run_service_config(project_id, password)
 
         # Try to create or replace the service
         resp = gcp_api("POST",
             f"https://{region}-run.googleapis.com/apis/serving.knative.dev/v1/namespaces/{project_id}/services",
-            json=service_config)
+            data=service_config)
 
         if resp and resp.status_code not in [200, 201, 409]:
             # Try update if create fails
             resp = gcp_api("PUT",
                 f"https://{region}-run.googleapis.com/apis/serving.knative.dev/v1/namespaces/{project_id}/services/{service_name}",
-                json=service_config)
+                data=service_config)
 
         if not resp or resp.status_code not in [200, 201]:
             error_msg = resp.text if resp else "No response"
-            return jsonify({"error": f"Deploy failed: {error_msg}"}), 500
+            raise RuntimeError(f"Deploy failed: {error_msg}")
 
-        # Wait for deployment
-        time.sleep(10)
+        # Wait for the new revision to become Ready (or fail)
+        poll_until(lambda: service_settled(project_id, region, service_name), timeout=60)
 
         # Step 3: Make service public
         state["step"] = "configuring"
@@ -299,7 +544,7 @@ def run_deploy():
             f"https://run.googleapis.com/v1/projects/{project_id}/locations/{region}/services/{service_name}")
 
         if resp and resp.status_code == 200:
-            service_data = resp.json()
+            service_data = json_loads(resp.content)
             service_url = service_data.get("status", {}).get("url", "")
             state["server_url"] = service_url
         else:
@@ -312,23 +557,17 @@ def run_deploy():
         # Update add-on configuration
         update_addon_config(state)
 
-        return jsonify({
-            "success": True,
-            "project_id": project_id,
-            "server_url": state.get("server_url", ""),
-            "password": password
-        })
-
     except Exception as e:
         import traceback
         traceback.print_exc()
-        return jsonify({"error": str(e)}), 500
+        state["step"] = "error"
+        state["error"] = str(e)
+        save_setup_state(state)
 
 
 def update_addon_config(state):
     """Update the add-on's configuration via Supervisor API."""
-    supervisor_token = os.environ.get("SUPERVISOR_TOKEN")
-    if not supervisor_token:
+    if not SUPERVISOR_TOKEN:
         return
 
     config = {
@@ -343,17 +582,17 @@ def update_addon_config(state):
     }
 
     try:
-        resp = requests.post(
-            "http://supervisor/addons/self/options",
-            headers={"Authorization": f"Bearer {supervisor_token}"},
+        resp = SESSION.post(
+            f"{SUPERVISOR_URL}/addons/self/options",
+            headers=SUPERVISOR_HEADERS,
             json={"options": config}
         )
 
         if resp.status_code == 200:
             # Restart add-on to apply config
-            requests.post(
-                "http://supervisor/addons/self/restart",
-                headers={"Authorization": f"Bearer {supervisor_token}"}
+            SESSION.post(
+                f"{SUPERVISOR_URL}/addons/self/restart",
+                headers=SUPERVISOR_HEADERS
             )
     except Exception as e:
         print(f"Failed to update config: {e}")
@@ -362,77 +601,84 @@ def update_addon_config(state):
 @app.route("/api/status")
 def get_status():
     """Get current setup status."""
-    state = get_setup_state()
-    has_key = SA_KEY_FILE.exists()
+    global _status_snapshot
+
+    state = load_json_cached(SETUP_FILE) or {}
+    has_key, project_id = get_sa_key_status()
+
+    # Whether a deploy is actually running in this process - a restart
+    # mid-deploy leaves an in-progress step in the state file
+    deploying = _deploy_future is not None and not _deploy_future.done()
+
+    # The UI polls this during setup; reuse the last body until the state
+    # file, key or deploy status changes
+    key = (state, has_key, project_id, deploying)
+    cached_key, body = _status_snapshot
+    if body is None or cached_key != key:
+        body = json_dumps({
+            "has_key": has_key,
+            "project_id": project_id,
+            "step": state.get("step", "start"),
+            "server_url": state.get("server_url"),
+            "has_password": state.get("password") is not None,
+            "error": state.get("error"),
+            "deploying": deploying
+        })
+        _status_snapshot = (key, body)
 
-    project_id = None
-    if has_key:
-        try:
-            sa_data = json.loads(SA_KEY_FILE.read_text())
-            project_id = sa_data.get("project_id")
-        except:
-            pass
-
-    return jsonify({
-        "has_key": has_key,
-        "project_id": project_id,
-        "step": state.get("step", "start"),
-        "server_url": state.get("server_url"),
-        "has_password": state.get("password") is not None
-    })
+    return app.response_class(body, mimetype="application/json")
 
 
 ENTITY_CONFIG_FILE = DATA_DIR / "entity_config.json"
 
 
+# Domains we expose to Google Assistant
+EXPOSED_DOMAINS = frozenset([
+    "light", "switch", "input_boolean", "climate", "fan", "humidifier",
+    "water_heater", "cover", "valve", "lock", "alarm_control_panel",
+    "media_player", "sensor", "binary_sensor", "scene", "script",
+    "input_select", "select", "button", "input_button", "vacuum",
+    "lawn_mower", "camera"
+])
+
+
 def get_entity_config():
-    """Load entity configuration."""
-    if ENTITY_CONFIG_FILE.exists():
-        return json.loads(ENTITY_CONFIG_FILE.read_text())
-    return {}
+    """Load entity configuration (shared - don't modify)."""
+    config = load_json_cached(ENTITY_CONFIG_FILE)
+    return config if config is not None else {}
 
 
 def save_entity_config(config):
     """Save entity configuration."""
-    DATA_DIR.mkdir(exist_ok=True)
-    ENTITY_CONFIG_FILE.write_text(json.dumps(config, indent=2))
+    write_json_cached(ENTITY_CONFIG_FILE, config)
 
 
 @app.route("/api/entities")
 def get_entities():
     """Get list of HA entities that can be exposed to Google Assistant."""
-    supervisor_token = os.environ.get("SUPERVISOR_TOKEN")
-    if not supervisor_token:
+    if not SUPERVISOR_TOKEN:
         return jsonify({"error": "Not running in HA environment"}), 500
 
-    # Domains we expose to Google Assistant
-    exposed_domains = [
-        "light", "switch", "input_boolean", "climate", "fan", "humidifier",
-        "water_heater", "cover", "valve", "lock", "alarm_control_panel",
-        "media_player", "sensor", "binary_sensor", "scene", "script",
-        "input_select", "select", "button", "input_button", "vacuum",
-        "lawn_mower", "camera"
-    ]
-
     try:
-        resp = requests.get(
-            "http://supervisor/core/api/states",
-            headers={"Authorization": f"Bearer {supervisor_token}"}
+        resp = SESSION.get(
+            f"{SUPERVISOR_URL}/core/api/states",
+            headers=SUPERVISOR_HEADERS
         )
         if resp.status_code != 200:
             return jsonify({"error": "Failed to fetch entities"}), 500
 
-        all_states = resp.json()
+        all_states = json_loads(resp.content)
         entity_config = get_entity_config()
 
         entities = []
+        append = entities.append
         for state in all_states:
             entity_id = state.get("entity_id", "")
-            domain = entity_id.split(".")[0] if "." in entity_id else ""
+            domain, dot, _ = entity_id.partition(".")
 
-            if domain in exposed_domains:
+            if dot and domain in EXPOSED_DOMAINS:
                 config = entity_config.get(entity_id, {})
-                entities.append({
+                append({
                     "entity_id": entity_id,
                     "friendly_name": state.get("attributes", {}).get("friendly_name", entity_id),
                     "domain": domain,
@@ -444,7 +690,7 @@ def get_entities():
                 })
 
         # Sort by domain then name
-        entities.sort(key=lambda e: (e["domain"], e["friendly_name"]))
+        entities.sort(key=itemgetter("domain", "friendly_name"))
         return jsonify({"entities": entities})
 
     except Exception as e:
@@ -482,6 +728,33 @@ def save_entities():
         return jsonify({"error": str(e)}), 500
 
 
+class YamlInclude(str):
+    """Path emitted as a Home Assistant `!include` tag."""
+
+
+# libyaml's C dumper when available, else the pure-Python one
+class GaPackageDumper(getattr(yaml, "CSafeDumper", yaml.SafeDumper)):
+    pass
+
+
+GaPackageDumper.add_representer(
+    YamlInclude, lambda dumper, path: dumper.represent_scalar("!include", str(path)))
+
+GA_PACKAGE_HEADER = """# Auto-generated by GCP Tunnel Client add-on
+# Uses Home Assistant's built-in Google Assistant integration
+# https://www.home-assistant.io/integrations/google_assistant/
+
+"""
+
+GA_EXPOSED_DOMAINS = [
+    "light", "switch", "input_boolean", "climate", "fan", "humidifier",
+    "water_heater", "cover", "valve", "lock", "alarm_control_panel",
+    "media_player", "sensor", "binary_sensor", "scene", "script",
+    "input_select", "select", "button", "input_button", "vacuum",
+    "lawn_mower", "camera", "event"
+]
+
+
 def regenerate_ga_package(entity_config):
     """Regenerate google_assistant package with entity config."""
     state = get_setup_state()
@@ -491,67 +764,42 @@ def regenerate_ga_package(entity_config):
 
     package_file = Path("/config/packages/gcp_tunnel_google_assistant.yaml")
 
-    # Build entity_config section
-    entity_config_yaml = ""
-    for entity_id, config in entity_config.items():
-        if not config.get("expose", True) or config.get("name") or config.get("aliases") or config.get("room"):
-            entity_config_yaml += f"    {entity_id}:\n"
-            if not config.get("expose", True):
-                entity_config_yaml += f"      expose: false\n"
-            if config.get("name"):
-                entity_config_yaml += f"      name: \"{config['name']}\"\n"
-            if config.get("aliases"):
-                entity_config_yaml += f"      aliases:\n"
-                for alias in config["aliases"]:
-                    entity_config_yaml += f"        - \"{alias}\"\n"
-            if config.get("room"):
-                entity_config_yaml += f"      room: \"{config['room']}\"\n"
-
-    # Write the package file
-    content = f"""# Auto-generated by GCP Tunnel Client add-on
-# Uses Home Assistant's built-in Google Assistant integration
-# https://www.home-assistant.io/integrations/google_assistant/
-
-google_assistant:
-  project_id: {project_id}
-  expose_by_default: true
-  exposed_domains:
-    - light
-    - switch
-    - input_boolean
-    - climate
-    - fan
-    - humidifier
-    - water_heater
-    - cover
-    - valve
-    - lock
-    - alarm_control_panel
-    - media_player
-    - sensor
-    - binary_sensor
-    - scene
-    - script
-    - input_select
-    - select
-    - button
-    - input_button
-    - vacuum
-    - lawn_mower
-    - camera
-    - event
-"""
+    ga = {
+        "project_id": project_id,
+        "expose_by_default": True,
+        "exposed_domains": GA_EXPOSED_DOMAINS,
+    }
 
     # Add service account if exists
     if SA_KEY_FILE.exists():
-        content += """  service_account: !include ../gcp_tunnel_service_account.json
-  report_state: true
-"""
-
-    # Add entity_config if any
-    if entity_config_yaml:
-        content += f"  entity_config:\n{entity_config_yaml}"
+        ga["service_account"] = YamlInclude("../gcp_tunnel_service_account.json")
+        ga["report_state"] = True
 
+    # Add entity_config section for customized entities
+    customized = {}
+    for entity_id, config in entity_config.items():
+        entry = {}
+        if not config.get("expose", True):
+            entry["expose"] = False
+        for key in ("name", "aliases", "room"):
+            if config.get(key):
+                entry[key] = config[key]
+        if entry:
+            customized[entity_id] = entry
+    if customized:
+        ga["entity_config"] = customized
+
+    content = GA_PACKAGE_HEADER + yaml.dump(
+        {"google_assistant": ga}, Dumper=GaPackageDumper,
+        sort_keys=False, default_flow_style=False, allow_unicode=True)
+
+    # Write the package file, unless it already has this content - a rewrite
+    # makes HA reload the package for nothing
+    try:
+        if package_file.read_text() == content:
+            return
+    except FileNotFoundError:
+        pass
     package_file.write_text(content)
 
 
@@ -713,28 +961,38 @@ echo "=========================================="
     return jsonify({"script": script})
 
 
+def running_processes(names):
+    """Return which of the given process names are running (like pgrep -x).
+
+    Reads /proc/<pid>/comm directly rather than forking pgrep per name.
+    """
+    found = set()
+    try:
+        with os.scandir("/proc") as entries:
+            for entry in entries:
+                if not entry.name.isdigit():
+                    continue
+                try:
+                    with open(f"/proc/{entry.name}/comm") as f:
+                        comm = f.read().rstrip("\n")
+                except OSError:
+                    continue  # process exited
+                if comm in names:
+                    found.add(comm)
+    except OSError:
+        pass
+    return found
+
+
 @app.route("/health")
 def health():
     """Health endpoint for monitoring and HA sensors."""
-    import subprocess
-
     state = get_setup_state()
 
-    # Check if chisel tunnel is running
-    tunnel_connected = False
-    try:
-        result = subprocess.run(["pgrep", "-x", "chisel"], capture_output=True)
-        tunnel_connected = result.returncode == 0
-    except:
-        pass
-
-    # Check if nginx proxy is running
-    proxy_running = False
-    try:
-        result = subprocess.run(["pgrep", "-x", "nginx"], capture_output=True)
-        proxy_running = result.returncode == 0
-    except:
-        pass
+    # Check if the chisel tunnel and nginx proxy are running
+    running = running_processes({"chisel", "nginx"})
+    tunnel_connected = "chisel" in running
+    proxy_running = "nginx" in running
 
     return jsonify({
         "status": "healthy" if tunnel_connected else "disconnected",
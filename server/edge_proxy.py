@@ -25,8 +25,13 @@ Architecture:
 
 Environment Variables:
     UPSTREAM_URL        - Tunnel endpoint (default: http://127.0.0.1:9001)
+    UPSTREAM_CONNECT_TIMEOUT - Upstream connect timeout in seconds (default: 1.0)
+    UPSTREAM_READ_TIMEOUT    - Upstream read timeout in seconds (default: 30)
     SYNC_CACHE_TTL      - Device list cache TTL in seconds (default: 300)
     QUERY_CACHE_TTL     - State cache TTL in seconds (default: 60)
+    ALEXA_DISCOVERY_TTL - Alexa device list cache TTL in seconds (default: 300)
+    SYNC_CACHE_MAX      - Max cached SYNC/Discovery users (default: 10000)
+    QUERY_CACHE_MAX     - Max cached device states (default: 100000)
     RATE_LIMIT_REQUESTS - Max requests per window (default: 100)
     RATE_LIMIT_WINDOW   - Rate limit window in seconds (default: 60)
     WEBHOOK_URL         - Optional webhook for events
@@ -36,18 +41,25 @@ Environment Variables:
 """
 
 import os
-import json
+import sys
 import time
+import hmac
+import queue
+import random
 import hashlib
 import logging
-from datetime import datetime
-from collections import defaultdict
-from functools import wraps
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache, wraps
+from itertools import islice
+from threading import BoundedSemaphore, Event, Lock, Thread
 from typing import Any, Optional
 
+import orjson
 import requests
-from flask import Flask, request, jsonify, Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, g, request, Response
 
 # =============================================================================
 # Configuration
@@ -55,12 +67,43 @@ from flask import Flask, request, jsonify, Response
 
 app = Flask(__name__)
 
+# Reject request bodies over 1MB before reading them (413). Werkzeug enforces
+# this on Content-Length and on chunked bodies as they are streamed.
+MAX_REQUEST_BYTES = 1_000_000
+app.config["MAX_CONTENT_LENGTH"] = MAX_REQUEST_BYTES
+
 # Upstream tunnel endpoint
 UPSTREAM_URL = os.environ.get("UPSTREAM_URL", "http://127.0.0.1:9001")
 
+# Upstream timeouts. The tunnel listens locally, so a connect that takes
+# more than a second means the HA side is gone - fail fast to the offline
+# fallback. Reads stay generous: a large SYNC can take a while.
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 1.0))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get("UPSTREAM_READ_TIMEOUT", 30))
+
+# Tunnel credentials for the /edge admin endpoints, parsed once at startup.
+# None if AUTH isn't "user:pass" (those endpoints are then unauthenticated).
+_auth_parts = os.environ.get("AUTH", "").split(":", 1)
+EDGE_AUTH = (
+    (_auth_parts[0].encode(), _auth_parts[1].encode()) if len(_auth_parts) == 2 else None
+)
+
 # Cache TTLs
 SYNC_CACHE_TTL = int(os.environ.get("SYNC_CACHE_TTL", 300))    # 5 minutes
 QUERY_CACHE_TTL = int(os.environ.get("QUERY_CACHE_TTL", 60))   # 1 minute
+ALEXA_DISCOVERY_TTL = int(os.environ.get("ALEXA_DISCOVERY_TTL", 300))  # 5 minutes
+
+# SYNC/Discovery entries live TTL ±10%, so users cached together (e.g. right
+# after a restart) don't all expire and re-fetch in the same instant
+CACHE_TTL_JITTER = 0.1
+
+# Cache size caps (oldest entries are evicted first)
+SYNC_CACHE_MAX = int(os.environ.get("SYNC_CACHE_MAX", 10_000))
+QUERY_CACHE_MAX = int(os.environ.get("QUERY_CACHE_MAX", 100_000))
+
+# How long a request waits on another thread's in-flight SYNC/Discovery
+# fetch for the same user before going upstream itself
+SINGLEFLIGHT_TIMEOUT = 10  # seconds
 
 # Rate limiting
 RATE_LIMIT_REQUESTS = int(os.environ.get("RATE_LIMIT_REQUESTS", 100))
@@ -69,6 +112,12 @@ RATE_LIMIT_WINDOW = int(os.environ.get("RATE_LIMIT_WINDOW", 60))  # seconds
 # Optional webhook for external notifications
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
 
+# Per-request events (execute, offline fallback) are coalesced and sent as
+# one POST per event type every WEBHOOK_BATCH_INTERVAL; cache fills are rare
+# and go out immediately.
+WEBHOOK_BATCH_INTERVAL = 0.1  # seconds
+WEBHOOK_IMMEDIATE_EVENTS = frozenset({"sync", "alexa_discovery"})
+
 # Request logging
 LOG_REQUESTS = os.environ.get("LOG_REQUESTS", "true").lower() == "true"
 
@@ -76,18 +125,107 @@ LOG_REQUESTS = os.environ.get("LOG_REQUESTS", "true").lower() == "true"
 # State (in-memory, resets on container restart)
 # =============================================================================
 
-# SYNC cache: {user_id: {response, expires_at}}
-sync_cache: dict[str, dict] = {}
-
-# QUERY cache: {device_id: {state, updated_at}}
+# Caches are plain dicts kept in insertion order: writers pop a key before
+# re-inserting it, so the first entry is always the oldest (see trim_cache)
+
+# Expiry times (expires_at) and rate-limit windows use time.monotonic(), so
+# wall-clock jumps can't pin or mass-expire entries. Timestamps handed back
+# to clients (updated_at, _cached_at) stay on time.time().
+
+# Cache entries are slotted dataclasses: a fraction of a dict's size per
+# entry, and fixed attribute access instead of key hashing.
+
+@dataclass(slots=True)
+class CachedResponse:
+    """A SYNC/Discovery answer, pre-serialized (see make_cache_entry)."""
+    response: dict
+    body: bytes
+    etag: str
+    cached_at: float    # monotonic
+    expires_at: float   # monotonic; served fresh until here
+    stale_until: float  # monotonic; served stale (with refresh) until here
+
+
+@dataclass(slots=True)
+class AlexaState:
+    """Last reported Alexa properties for an endpoint (offline fallback)."""
+    properties: list
+    updated_at: float   # wall clock
+
+
+# SYNC cache: {user_id: CachedResponse}
+sync_cache: dict[str, CachedResponse] = {}
+
+# In-flight upstream fetches on a cache miss: {key: Event}. The first thread
+# to miss fetches; others wait on its Event, then re-read the cache.
+sync_inflight: dict[str, Event] = {}
+inflight_lock = Lock()
+
+# QUERY cache, as two parallel dicts with the same keys:
+#   query_cache:      {device_id: state}
+#   query_updated_at: {device_id: updated_at}
+# Flat layout: no per-device wrapper dict, and stats sum plain floats.
+# No TTL eviction - stale states are exactly what offline fallback serves.
+# Written in batches with dict.update, so a refreshed device keeps its
+# original position and size trimming evicts the longest-cached first.
 query_cache: dict[str, dict] = {}
+query_updated_at: dict[str, float] = {}
+
+# Running totals of sync_cache cached_at and query_updated_at values, kept
+# in step with every insert and eviction so edge_stats ages are O(1).
+# Guarded by the matching cache lock below.
+sync_cached_total = 0.0
+query_updated_total = 0.0
+
+# One write lock per cache, so SYNC, QUERY and Alexa traffic don't contend.
+# Readers don't take them: single-key dict get/set is atomic under the GIL
+# and entries are replaced whole, never mutated. Code holding more than one
+# takes them in declaration order (sync, query, then the Alexa locks).
+sync_cache_lock = Lock()
+query_cache_lock = Lock()
+
+# Rate limiting, sharded by IP hash so unrelated IPs don't contend on a
+# single mutex. Each shard has its own dict and lock:
+#   rate_shards[i]: {ip: (previous_count, current_count, current_window)}
+# rate_swept_windows[i] is the last window shard i was pruned in.
+RATE_LIMIT_SHARDS = 16
+rate_shards: list[dict[str, tuple[int, int, float]]] = [{} for _ in range(RATE_LIMIT_SHARDS)]
+rate_locks = [Lock() for _ in range(RATE_LIMIT_SHARDS)]
+rate_swept_windows = [0.0] * RATE_LIMIT_SHARDS
+
+# Shared HTTP session: keeps TCP connections to the tunnel (and webhook)
+# alive across requests instead of a fresh handshake per call.
+# Only failed connects are retried (once): the request was never sent, so
+# that's safe even for EXECUTE. Read/status errors are not retried - a POST
+# may already have been acted on.
+http_session = requests.Session()
+_http_adapter = HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=128,
+    max_retries=Retry(total=1, connect=1, read=0, status=0, backoff_factor=0.05),
+)
+http_session.mount("http://", _http_adapter)
+http_session.mount("https://", _http_adapter)
+http_session.headers["Content-Type"] = "application/json"
 
-# Lock for cache operations (thread-safe)
-cache_lock = Lock()
+# Webhook delivery runs in the background; at most WEBHOOK_MAX_PENDING
+# deliveries may be queued or in flight before new events are dropped
+WEBHOOK_MAX_PENDING = 64
+webhook_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="webhook")
+webhook_slots = BoundedSemaphore(WEBHOOK_MAX_PENDING)
 
-# Rate limiting: {ip: [timestamps]}
-rate_limits: dict[str, list[float]] = defaultdict(list)
-rate_lock = Lock()
+# Coalesced webhook events awaiting the next flush: {event_type: [data, ...]}
+webhook_batches: dict[str, list[dict]] = {}
+webhook_batch_lock = Lock()
+
+# Request log lines are written to stdout by a background thread; handlers
+# only enqueue. If the writer falls LOG_QUEUE_MAX lines behind, new lines
+# are dropped rather than blocking requests.
+LOG_QUEUE_MAX = 4096
+log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
+
+# Background refreshes of stale SYNC/Discovery entries (see refresh_in_background)
+refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="refresh")
 
 # Remote UI toggle (controlled by HA add-on)
 remote_ui_settings = {
@@ -115,26 +253,120 @@ def get_client_ip() -> str:
 
     Cloud Run sets X-Forwarded-For, so we use that first.
     Takes first IP if multiple (client's original IP).
+
+    Memoized on flask.g - rate limiting and logging both ask per request.
     """
-    forwarded = request.headers.get("X-Forwarded-For", "")
+    ip = g.get("client_ip")
+    if ip is not None:
+        return ip
+
+    forwarded = request.headers.get("X-Forwarded-For")
     if forwarded:
-        return forwarded.split(",")[0].strip()
-    return request.remote_addr or "unknown"
+        ip = forwarded.partition(",")[0].strip()
+    else:
+        ip = request.remote_addr or "unknown"
+    g.client_ip = ip
+    return ip
 
 
-def validate_json_safe(data: Any) -> bool:
-    """Basic validation that data is safe JSON (no excessive nesting/size).
+def parse_json_body() -> Optional[dict]:
+    """Parse the request body with orjson.
 
-    TODO: Add more robust validation for production.
+    This is the only validation pass: size is capped by MAX_CONTENT_LENGTH
+    before the body is read, and orjson rejects malformed input (and nesting
+    deeper than 1024) while parsing. Reads the raw body without caching it on
+    the request. Returns None unless the body is a JSON object; an empty
+    body parses as {}.
     """
     try:
-        serialized = json.dumps(data)
-        # Reject if > 1MB
-        if len(serialized) > 1_000_000:
-            return False
+        data = orjson.loads(request.get_data(cache=False) or b"{}")
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def json_response(obj: Any, status: int = 200) -> Response:
+    """Build a JSON response from orjson bytes (no jsonify round-trip)."""
+    return Response(orjson.dumps(obj), status=status, mimetype="application/json")
+
+
+def make_cache_entry(response: dict, now: float, ttl: float) -> CachedResponse:
+    """Build a cache entry holding the response pre-serialized.
+
+    now is time.monotonic(); the entry is fresh for ttl (with jitter applied)
+    and servable stale for one more ttl after that (stale-while-revalidate:
+    a stale entry is served immediately while a background refresh runs;
+    only past stale_until does a request wait on upstream).
+
+    Cache hits are served straight from ``body``; the ETag is a short blake2b
+    digest of those bytes so clients can tell when the device list changed.
+    """
+    body = orjson.dumps(response)
+    expires_at = now + jittered_ttl(ttl)
+    return CachedResponse(
+        response=response,
+        body=body,
+        etag=hashlib.blake2b(body, digest_size=16).hexdigest(),
+        cached_at=now,
+        expires_at=expires_at,
+        stale_until=expires_at + ttl,
+    )
+
+
+def cached_response(entry: CachedResponse) -> Response:
+    """Serve a cache entry's pre-serialized body with its ETag."""
+    resp = Response(entry.body, mimetype="application/json")
+    resp.set_etag(entry.etag)
+    return resp
+
+
+def join_inflight(inflight: dict[str, Event], key: str) -> tuple[Event, bool]:
+    """Join the in-flight fetch for key, or start one.
+
+    Returns (event, leader). The leader must fetch and then call
+    finish_inflight(); everyone else waits on the event.
+    """
+    with inflight_lock:
+        event = inflight.get(key)
+        if event is not None:
+            return event, False
+        event = inflight[key] = Event()
+        return event, True
+
+
+def finish_inflight(inflight: dict[str, Event], key: str, event: Event) -> None:
+    """End the leader's fetch for key and wake the waiters."""
+    with inflight_lock:
+        inflight.pop(key, None)
+    event.set()
+
+
+def check_edge_auth(auth) -> bool:
+    """Check request Basic auth against the tunnel credentials.
+
+    Both fields are compared in constant time, and always both, so timing
+    doesn't reveal which one was wrong.
+    """
+    if EDGE_AUTH is None:
         return True
-    except (TypeError, ValueError):
+    if not auth:
         return False
+    user_ok = hmac.compare_digest((auth.username or "").encode(), EDGE_AUTH[0])
+    pass_ok = hmac.compare_digest((auth.password or "").encode(), EDGE_AUTH[1])
+    return user_ok & pass_ok
+
+
+def elapsed_ms(start_ns: int) -> int:
+    """Milliseconds since start_ns, a time.monotonic_ns() reading."""
+    return (time.monotonic_ns() - start_ns) // 1_000_000
+
+
+def iso_now() -> str:
+    """Current UTC time as an ISO 8601 string (second resolution).
+
+    Same format as the logger's datefmt; avoids allocating a datetime.
+    """
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
 
 # =============================================================================
@@ -144,7 +376,9 @@ def validate_json_safe(data: Any) -> bool:
 def rate_limit(f):
     """Rate limiting decorator.
 
-    Uses sliding window algorithm. Limits requests per IP.
+    Approximates a sliding window with two fixed-window counters per IP
+    (current + previous, weighted by overlap): O(1) time and memory per IP
+    regardless of the limit. Limits requests per IP.
 
     Note: In-memory only - doesn't persist across restarts or scale
     across multiple instances. For production at scale, use Redis.
@@ -154,25 +388,44 @@ def rate_limit(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         ip = get_client_ip()
-        now = time.time()
+        now = time.monotonic()
+
+        window, offset = divmod(now, RATE_LIMIT_WINDOW)
+        shard = hash(ip) & (RATE_LIMIT_SHARDS - 1)
+        rate_limits = rate_shards[shard]
+
+        with rate_locks[shard]:
+            # Once per window, forget IPs idle for two or more windows -
+            # their counts no longer affect any estimate
+            if rate_swept_windows[shard] != window:
+                idle = [k for k, v in rate_limits.items() if window - v[2] > 1]
+                for k in idle:
+                    del rate_limits[k]
+                rate_swept_windows[shard] = window
+
+            prev_count, count, count_window = rate_limits.get(ip, (0, 0, window))
+
+            # Roll over into a new window; the old count only carries over
+            # as "previous" if it was the immediately preceding window
+            if count_window != window:
+                prev_count = count if window - count_window == 1 else 0
+                count = 0
 
-        with rate_lock:
-            # Remove timestamps outside the window
-            rate_limits[ip] = [
-                t for t in rate_limits[ip]
-                if now - t < RATE_LIMIT_WINDOW
-            ]
+            # Weight the previous window by how much of it the sliding window
+            # still overlaps
+            estimate = prev_count * (1 - offset / RATE_LIMIT_WINDOW) + count
 
             # Check if over limit
-            if len(rate_limits[ip]) >= RATE_LIMIT_REQUESTS:
+            if estimate >= RATE_LIMIT_REQUESTS:
+                rate_limits[ip] = (prev_count, count, window)
                 logger.warning(f"Rate limit exceeded: ip={ip}")
-                return jsonify({
+                return json_response({
                     "error": "rate_limit_exceeded",
                     "retry_after": RATE_LIMIT_WINDOW
-                }), 429
+                }, 429)
 
             # Record this request
-            rate_limits[ip].append(now)
+            rate_limits[ip] = (prev_count, count + 1, window)
 
         return f(*args, **kwargs)
     return decorated
@@ -182,60 +435,131 @@ def rate_limit(f):
 # Cache Functions
 # =============================================================================
 
-def cache_sync_response(user_id: str, response: dict) -> None:
-    """Cache a SYNC response (device list).
+def jittered_ttl(ttl: float) -> float:
+    """TTL spread uniformly over ±CACHE_TTL_JITTER (mean stays ttl)."""
+    return ttl * random.uniform(1 - CACHE_TTL_JITTER, 1 + CACHE_TTL_JITTER)
+
+
+def trim_cache(cache: dict, max_size: int, now: Optional[float] = None) -> list:
+    """Evict the oldest entries beyond max_size, and dead ones if now is given.
+
+    An entry is dead once past stale_until (no longer servable even stale).
+    Insertion order is expiry order to within the TTL jitter, so dead
+    entries collect at the front; one sitting behind a slightly longer-lived
+    neighbour is evicted a little later (reads check the times anyway).
+    Caller must hold the cache's lock. Returns the evicted entries.
+    """
+    evicted = []
+    while cache:
+        key = next(iter(cache))
+        if len(cache) <= max_size and (now is None or cache[key].stale_until > now):
+            break
+        evicted.append(cache.pop(key))
+    return evicted
+
+
+def cache_sync_response(user_id: str, response: dict) -> CachedResponse:
+    """Cache a SYNC response (device list) and return the new entry.
 
     SYNC responses are expensive (full device enumeration) but stable.
-    Cache for 5 minutes to reduce load on HA.
+    Cache for 5 minutes to reduce load on HA. Serialization happens once,
+    outside the lock.
     """
-    with cache_lock:
-        sync_cache[user_id] = {
-            "response": response,
-            "expires_at": time.time() + SYNC_CACHE_TTL
-        }
+    global sync_cached_total
+    now = time.monotonic()
+    entry = make_cache_entry(response, now, SYNC_CACHE_TTL)
+    with sync_cache_lock:
+        old = sync_cache.pop(user_id, None)
+        if old is not None:
+            sync_cached_total -= old.cached_at
+        sync_cache[user_id] = entry
+        sync_cached_total += now
+        for old in trim_cache(sync_cache, SYNC_CACHE_MAX, now):
+            sync_cached_total -= old.cached_at
     # Truncate user_id in logs for privacy
     logger.info(f"Cached SYNC: user={user_id[:8]}... ttl={SYNC_CACHE_TTL}s")
+    return entry
+
 
+def get_cached_sync(user_id: str, now: Optional[float] = None) -> Optional[CachedResponse]:
+    """Get the cached SYNC entry if servable at monotonic time now.
 
-def get_cached_sync(user_id: str) -> Optional[dict]:
-    """Get cached SYNC response if still valid."""
-    with cache_lock:
-        cached = sync_cache.get(user_id)
-        if cached and cached["expires_at"] > time.time():
-            logger.info(f"SYNC cache hit: user={user_id[:8]}...")
-            return cached["response"]
+    The entry may be stale (past expires_at); the caller refreshes it.
+    """
+    if now is None:
+        now = time.monotonic()
+    cached = sync_cache.get(user_id)
+    if cached and cached.stale_until > now:
+        stale = " (stale)" if cached.expires_at <= now else ""
+        logger.info(f"SYNC cache hit{stale}: user={user_id[:8]}...")
+        return cached
     return None
 
 
+def refresh_in_background(inflight: dict[str, Event], key: str, fetch, *args) -> None:
+    """Run fetch(*args) on refresh_executor unless key is already being fetched.
+
+    Stale-while-revalidate: the caller has already answered from the stale
+    entry. The refresh registers in the same singleflight map as foreground
+    misses, so a cold miss arriving meanwhile waits on it instead.
+    """
+    event, leader = join_inflight(inflight, key)
+    if not leader:
+        return
+
+    def run() -> None:
+        try:
+            fetch(*args)
+        except Exception as e:
+            logger.error(f"Background refresh failed: key={key[:8]}... error={e}")
+        finally:
+            finish_inflight(inflight, key, event)
+
+    try:
+        refresh_executor.submit(run)
+    except RuntimeError:
+        # Executor shut down (interpreter exiting)
+        finish_inflight(inflight, key, event)
+
+
 def cache_query_states(devices: dict) -> None:
     """Cache device states from QUERY response.
 
     Used for offline fallback - if HA is unreachable, return last known state.
+    Timestamps are built outside the lock; each dict gets a single update().
     """
-    with cache_lock:
-        for device_id, state in devices.items():
-            query_cache[device_id] = {
-                "state": state,
-                "updated_at": time.time()
-            }
+    global query_updated_total
+    now = time.time()
+    timestamps = dict.fromkeys(devices, now)
+    with query_cache_lock:
+        replaced = [t for t in map(query_updated_at.get, devices) if t is not None]
+        query_updated_total += now * len(timestamps) - sum(replaced)
+        query_cache.update(devices)
+        query_updated_at.update(timestamps)
+        excess = len(query_updated_at) - QUERY_CACHE_MAX
+        if excess > 0:
+            for device_id in list(islice(query_updated_at, excess)):
+                query_updated_total -= query_updated_at.pop(device_id)
+                del query_cache[device_id]
     logger.info(f"Cached states: devices={len(devices)}")
 
 
-def get_cached_states(device_ids: list[str]) -> dict:
+def get_cached_states(device_ids: list[str]) -> tuple[dict, Optional[float]]:
     """Get cached states for offline fallback.
 
-    Adds _cached flag so clients know this is stale data.
+    Returns (states, oldest updated_at). Cached state dicts are returned
+    as-is (not copied); the caller marks the whole payload as cached.
     """
     states = {}
-    with cache_lock:
-        for device_id in device_ids:
-            cached = query_cache.get(device_id)
-            if cached:
-                state = cached["state"].copy()
-                state["_cached"] = True
-                state["_cached_at"] = cached["updated_at"]
-                states[device_id] = state
-    return states
+    oldest = None
+    for device_id in device_ids:
+        state = query_cache.get(device_id)
+        if state is not None:
+            states[device_id] = state
+            updated_at = query_updated_at.get(device_id, 0.0)
+            if oldest is None or updated_at < oldest:
+                oldest = updated_at
+    return states, oldest
 
 
 # =============================================================================
@@ -248,11 +572,16 @@ def log_request(
     response_data: Optional[dict],
     duration_ms: int,
     cached: bool = False,
-    offline: bool = False
+    offline: bool = False,
+    devices: Optional[list] = None
 ) -> None:
     """Log request as structured JSON for audit trail.
 
-    Outputs to stdout (captured by Cloud Run logging).
+    devices is the request payload's device list (QUERY/EXECUTE), passed in
+    by the handler that already unpacked it.
+
+    Outputs to stdout (captured by Cloud Run logging). The entry is built
+    here, on the request thread; the write happens on the log writer thread.
     """
     if not LOG_REQUESTS:
         return
@@ -265,7 +594,7 @@ def log_request(
         "cached": cached,
         "offline": offline,
         "request_id": request_data.get("requestId", "unknown"),
-        "timestamp": datetime.utcnow().isoformat() + "Z"
+        "timestamp": iso_now()
     }
 
     # Add device count for SYNC
@@ -274,21 +603,41 @@ def log_request(
         log_entry["device_count"] = len(payload.get("devices", []))
 
     # Add device IDs for QUERY/EXECUTE (first 5 only for brevity)
-    if intent in ["action.devices.QUERY", "action.devices.EXECUTE"]:
-        inputs = request_data.get("inputs", [{}])
-        if inputs:
-            payload = inputs[0].get("payload", {})
-            devices = payload.get("devices", [])
-            if devices:
-                log_entry["device_ids"] = [d.get("id") for d in devices[:5]]
+    if devices:
+        log_entry["device_ids"] = [d.get("id") for d in devices[:5]]
+
+    try:
+        log_queue.put_nowait(log_entry)
+    except queue.Full:
+        pass
+
+
+def _write_logs() -> None:
+    """Log writer thread: drain log_queue to stdout, one flush per batch."""
+    while True:
+        lines = [orjson.dumps(log_queue.get())]
+        while True:
+            try:
+                lines.append(orjson.dumps(log_queue.get_nowait()))
+            except queue.Empty:
+                break
+        lines.append(b"")
+        sys.stdout.buffer.write(b"\n".join(lines))
+        sys.stdout.flush()
 
-    print(json.dumps(log_entry), flush=True)
+
+Thread(target=_write_logs, name="log-writer", daemon=True).start()
 
 
 def call_webhook(event_type: str, data: dict) -> None:
     """Call external webhook if configured.
 
-    Non-blocking, fire-and-forget. Failures are logged but don't affect response.
+    Non-blocking, fire-and-forget: delivery happens on webhook_executor so
+    the request never waits on the webhook.
+
+    WEBHOOK_IMMEDIATE_EVENTS are sent right away as {event, timestamp, data}.
+    Everything else is buffered and sent by the batcher thread as
+    {event, timestamp, count, batch: [data, ...]}.
 
     TODO: Add retry logic with exponential backoff.
     TODO: Add webhook signature for security.
@@ -296,19 +645,70 @@ def call_webhook(event_type: str, data: dict) -> None:
     if not WEBHOOK_URL:
         return
 
+    if event_type not in WEBHOOK_IMMEDIATE_EVENTS:
+        with webhook_batch_lock:
+            webhook_batches.setdefault(event_type, []).append(data)
+        return
+
+    submit_webhook(event_type, {
+        "event": event_type,
+        "timestamp": iso_now(),
+        "data": data
+    })
+
+
+def submit_webhook(event_type: str, payload: dict) -> None:
+    """Queue a webhook POST on webhook_executor.
+
+    Dropped (and logged) when too many deliveries are already pending.
+    """
+    if not webhook_slots.acquire(blocking=False):
+        logger.warning(f"Webhook dropped (backlog full): event={event_type}")
+        return
+
     try:
-        payload = {
-            "event": event_type,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "data": data
-        }
-        # Short timeout - don't block on slow webhooks
-        requests.post(WEBHOOK_URL, json=payload, timeout=5)
+        webhook_executor.submit(_send_webhook, event_type, payload)
+    except RuntimeError:
+        # Executor shut down (interpreter exiting)
+        webhook_slots.release()
+
+
+def _flush_webhook_batches() -> None:
+    """Webhook batcher thread: one POST per buffered event type per interval."""
+    while True:
+        time.sleep(WEBHOOK_BATCH_INTERVAL)
+        with webhook_batch_lock:
+            if not webhook_batches:
+                continue
+            batches = dict(webhook_batches)
+            webhook_batches.clear()
+
+        timestamp = iso_now()
+        for event_type, batch in batches.items():
+            submit_webhook(event_type, {
+                "event": event_type,
+                "timestamp": timestamp,
+                "count": len(batch),
+                "batch": batch
+            })
+
+
+if WEBHOOK_URL:
+    Thread(target=_flush_webhook_batches, name="webhook-batcher", daemon=True).start()
+
+
+def _send_webhook(event_type: str, payload: dict) -> None:
+    """Deliver a webhook payload. Runs on webhook_executor."""
+    try:
+        # Short timeout - don't tie up a delivery thread on slow webhooks
+        http_session.post(WEBHOOK_URL, data=orjson.dumps(payload), timeout=5)
         logger.info(f"Webhook sent: event={event_type}")
     except requests.exceptions.Timeout:
         logger.warning(f"Webhook timeout: event={event_type}")
     except Exception as e:
         logger.error(f"Webhook failed: event={event_type} error={e}")
+    finally:
+        webhook_slots.release()
 
 
 # =============================================================================
@@ -322,22 +722,23 @@ def proxy_to_upstream(path: str, data: dict, headers) -> tuple[Optional[dict], i
     """
     url = f"{UPSTREAM_URL}{path}"
 
-    # Only forward safe headers
-    forward_headers = {
-        "Content-Type": "application/json",
-        "Authorization": headers.get("Authorization", ""),
-    }
+    # Only forward safe headers (Content-Type is a session default)
+    auth = headers.get("Authorization")
+    forward_headers = {"Authorization": auth} if auth else None
 
     try:
-        resp = requests.post(url, json=data, headers=forward_headers, timeout=30)
-        return resp.json(), resp.status_code, False
+        resp = http_session.post(
+            url, data=orjson.dumps(data), headers=forward_headers,
+            timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT)
+        )
+        return orjson.loads(resp.content), resp.status_code, False
     except requests.exceptions.Timeout:
         logger.error(f"Upstream timeout: path={path}")
         return None, 504, True
     except requests.exceptions.ConnectionError:
         logger.error(f"Upstream connection error: path={path}")
         return None, 502, True
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         logger.error(f"Upstream invalid JSON: path={path}")
         return None, 502, True
     except Exception as e:
@@ -345,6 +746,16 @@ def proxy_to_upstream(path: str, data: dict, headers) -> tuple[Optional[dict], i
         return None, 500, True
 
 
+# =============================================================================
+# Error Handlers
+# =============================================================================
+
+@app.errorhandler(413)
+def payload_too_large(e):
+    """JSON error for bodies over MAX_REQUEST_BYTES."""
+    return json_response({"error": "payload_too_large"}, 413)
+
+
 # =============================================================================
 # Google Assistant Endpoint
 # =============================================================================
@@ -359,123 +770,175 @@ def google_assistant():
     - QUERY: Return current state of devices (cached for offline fallback)
     - EXECUTE: Execute commands on devices (never cached)
 
+    Each intent is dispatched to its handler via GOOGLE_INTENT_HANDLERS.
+
     TODO: Add Alexa Smart Home endpoint with similar caching.
     TODO: Add intent validation (verify request signature from Google).
     """
-    start_time = time.time()
-
-    # Parse request
-    data = request.get_json() or {}
+    start_time = time.monotonic_ns()
 
-    # Basic validation
-    if not validate_json_safe(data):
-        return jsonify({"error": "invalid_request"}), 400
+    # Parse request (size already capped by MAX_CONTENT_LENGTH)
+    data = parse_json_body()
+    if data is None:
+        return json_response({"error": "invalid_request"}, 400)
 
     # Extract intent
-    inputs = data.get("inputs", [])
-    intent = inputs[0].get("intent", "unknown") if inputs else "unknown"
+    inputs = data.get("inputs")
+    first = inputs[0] if inputs else {}
+    intent = first.get("intent", "unknown")
+    payload = first.get("payload") or {}
     user_id = data.get("agentUserId", "default")
 
-    # -------------------------------------------------------------------------
-    # SYNC: Return device list (cached)
-    # -------------------------------------------------------------------------
-    if intent == "action.devices.SYNC":
-        # Check cache first
-        cached = get_cached_sync(user_id)
-        if cached:
-            duration_ms = int((time.time() - start_time) * 1000)
-            log_request(intent, data, cached, duration_ms, cached=True)
-            return jsonify(cached)
-
-        # Forward to HA
-        response, status, is_error = proxy_to_upstream(
-            "/api/google_assistant", data, request.headers
-        )
+    handler = GOOGLE_INTENT_HANDLERS.get(intent, handle_google_unknown)
+    return handler(intent, data, payload, user_id, start_time)
 
-        if not is_error and response:
-            cache_sync_response(user_id, response)
-            device_count = len(response.get("payload", {}).get("devices", []))
-            call_webhook("sync", {"user_id": user_id[:8], "device_count": device_count})
-
-        duration_ms = int((time.time() - start_time) * 1000)
-        log_request(intent, data, response, duration_ms)
-
-        if is_error or not response:
-            return jsonify({"error": "upstream_error"}), status
-        return jsonify(response)
-
-    # -------------------------------------------------------------------------
-    # QUERY: Return device states (cached for offline fallback)
-    # -------------------------------------------------------------------------
-    elif intent == "action.devices.QUERY":
-        payload = inputs[0].get("payload", {}) if inputs else {}
-        devices = payload.get("devices", [])
-        device_ids = [d.get("id") for d in devices if d.get("id")]
-
-        # Try upstream first
-        response, status, is_error = proxy_to_upstream(
-            "/api/google_assistant", data, request.headers
-        )
 
-        if not is_error and response:
-            # Cache states for offline fallback
-            resp_devices = response.get("payload", {}).get("devices", {})
-            if resp_devices:
-                cache_query_states(resp_devices)
-
-            duration_ms = int((time.time() - start_time) * 1000)
-            log_request(intent, data, response, duration_ms)
-            return jsonify(response)
-
-        # Offline fallback - return cached states
-        cached_states = get_cached_states(device_ids)
-        if cached_states:
-            logger.warning(f"Offline fallback: devices={len(cached_states)}")
-            fallback_response = {
-                "requestId": data.get("requestId"),
-                "payload": {"devices": cached_states}
+# -----------------------------------------------------------------------------
+# SYNC: Return device list (cached)
+# -----------------------------------------------------------------------------
+
+def fetch_sync(user_id: str, data: dict, headers) -> tuple[Optional[dict], int, Optional[CachedResponse]]:
+    """Forward SYNC to HA and cache a good answer.
+
+    Returns (response, status, cache entry or None on error).
+    """
+    response, status, is_error = proxy_to_upstream("/api/google_assistant", data, headers)
+    if is_error or not response:
+        return response, status, None
+
+    entry = cache_sync_response(user_id, response)
+    device_count = len(response.get("payload", {}).get("devices", []))
+    call_webhook("sync", {"user_id": user_id[:8], "device_count": device_count})
+    return response, status, entry
+
+
+def handle_google_sync(intent: str, data: dict, payload: dict, user_id: str, start_time: int):
+    # Check cache first (as of request start: monotonic_ns and monotonic
+    # share a clock); on a miss, wait out any fetch already in flight
+    now = start_time / 1e9
+    cached = get_cached_sync(user_id, now)
+    if not cached:
+        event, leader = join_inflight(sync_inflight, user_id)
+        if not leader:
+            event.wait(SINGLEFLIGHT_TIMEOUT)
+            now = time.monotonic()
+            cached = get_cached_sync(user_id, now)
+    if cached:
+        if cached.expires_at <= now:
+            # Stale: answer now, refresh for the next request
+            refresh_in_background(
+                sync_inflight, user_id, fetch_sync,
+                user_id, data, {"Authorization": request.headers.get("Authorization")}
+            )
+        duration_ms = elapsed_ms(start_time)
+        log_request(intent, data, cached.response, duration_ms, cached=True)
+        return cached_response(cached)
+
+    # Forward to HA (the leader's fetch failed or timed out if we're not it)
+    try:
+        response, status, entry = fetch_sync(user_id, data, request.headers)
+    finally:
+        if leader:
+            finish_inflight(sync_inflight, user_id, event)
+
+    duration_ms = elapsed_ms(start_time)
+    log_request(intent, data, response, duration_ms)
+
+    if entry is None:
+        return json_response({"error": "upstream_error"}, status)
+    return cached_response(entry)
+
+
+# -----------------------------------------------------------------------------
+# QUERY: Return device states (cached for offline fallback)
+# -----------------------------------------------------------------------------
+
+def handle_google_query(intent: str, data: dict, payload: dict, user_id: str, start_time: int):
+    devices = payload.get("devices") or []
+    device_ids = [d.get("id") for d in devices if d.get("id")]
+
+    # Try upstream first
+    response, status, is_error = proxy_to_upstream(
+        "/api/google_assistant", data, request.headers
+    )
+
+    if not is_error and response:
+        # Cache states for offline fallback
+        resp_devices = response.get("payload", {}).get("devices", {})
+        if resp_devices:
+            cache_query_states(resp_devices)
+
+        duration_ms = elapsed_ms(start_time)
+        log_request(intent, data, response, duration_ms, devices=devices)
+        return json_response(response)
+
+    # Offline fallback - return cached states
+    cached_states, cached_at = get_cached_states(device_ids)
+    if cached_states:
+        logger.warning(f"Offline fallback: devices={len(cached_states)}")
+        # _cached flags tell clients this is stale data
+        fallback_response = {
+            "requestId": data.get("requestId"),
+            "payload": {
+                "devices": cached_states,
+                "_cached": True,
+                "_cached_at": cached_at
             }
-            duration_ms = int((time.time() - start_time) * 1000)
-            log_request(intent, data, fallback_response, duration_ms, offline=True)
-            call_webhook("offline_fallback", {"device_ids": device_ids[:5]})
-            return jsonify(fallback_response)
-
-        # No cache available
-        return jsonify({"error": "upstream_unavailable"}), status
-
-    # -------------------------------------------------------------------------
-    # EXECUTE: Run commands (never cached)
-    # -------------------------------------------------------------------------
-    elif intent == "action.devices.EXECUTE":
-        response, status, is_error = proxy_to_upstream(
-            "/api/google_assistant", data, request.headers
-        )
+        }
+        duration_ms = elapsed_ms(start_time)
+        log_request(intent, data, fallback_response, duration_ms, offline=True, devices=devices)
+        call_webhook("offline_fallback", {"device_ids": device_ids[:5]})
+        return json_response(fallback_response)
 
-        if response:
-            commands = inputs[0].get("payload", {}).get("commands", []) if inputs else []
-            call_webhook("execute", {"command_count": len(commands)})
+    # No cache available
+    return json_response({"error": "upstream_unavailable"}, status)
 
-        duration_ms = int((time.time() - start_time) * 1000)
-        log_request(intent, data, response, duration_ms)
 
-        if is_error:
-            return jsonify({"error": "upstream_error"}), status
-        return jsonify(response)
+# -----------------------------------------------------------------------------
+# EXECUTE: Run commands (never cached)
+# -----------------------------------------------------------------------------
 
-    # -------------------------------------------------------------------------
-    # Unknown intent - proxy as-is
-    # -------------------------------------------------------------------------
-    else:
-        logger.warning(f"Unknown intent: {intent}")
-        response, status, is_error = proxy_to_upstream(
-            "/api/google_assistant", data, request.headers
-        )
-        duration_ms = int((time.time() - start_time) * 1000)
-        log_request(intent, data, response, duration_ms)
+def handle_google_execute(intent: str, data: dict, payload: dict, user_id: str, start_time: int):
+    # Hottest intent in steady state and never cached: no cache or lock
+    # work, and the request body is only looked at if a webhook needs it
+    response, status, is_error = proxy_to_upstream(
+        "/api/google_assistant", data, request.headers
+    )
+
+    if response and WEBHOOK_URL:
+        commands = payload.get("commands") or ()
+        call_webhook("execute", {"command_count": len(commands)})
 
-        if is_error:
-            return jsonify({"error": "upstream_error"}), status
-        return jsonify(response)
+    duration_ms = elapsed_ms(start_time)
+    log_request(intent, data, response, duration_ms, devices=payload.get("devices"))
+
+    if is_error:
+        return json_response({"error": "upstream_error"}, status)
+    return json_response(response)
+
+
+# -----------------------------------------------------------------------------
+# Unknown intent - proxy as-is
+# -----------------------------------------------------------------------------
+
+def handle_google_unknown(intent: str, data: dict, payload: dict, user_id: str, start_time: int):
+    logger.warning(f"Unknown intent: {intent}")
+    response, status, is_error = proxy_to_upstream(
+        "/api/google_assistant", data, request.headers
+    )
+    duration_ms = elapsed_ms(start_time)
+    log_request(intent, data, response, duration_ms)
+
+    if is_error:
+        return json_response({"error": "upstream_error"}, status)
+    return json_response(response)
+
+
+GOOGLE_INTENT_HANDLERS = {
+    "action.devices.SYNC": handle_google_sync,
+    "action.devices.QUERY": handle_google_query,
+    "action.devices.EXECUTE": handle_google_execute,
+}
 
 
 # =============================================================================
@@ -489,26 +952,29 @@ def edge_stats():
     Returns cache sizes, ages, and rate limiting info.
     """
     now = time.time()
+    mono_now = time.monotonic()
 
-    with cache_lock:
+    # Snapshot each count and running total under its own lock
+    with sync_cache_lock:
         sync_count = len(sync_cache)
-        query_count = len(query_cache)
-        sync_ages = [now - c["expires_at"] + SYNC_CACHE_TTL for c in sync_cache.values()]
-        query_ages = [now - c["updated_at"] for c in query_cache.values()]
+        sync_total = sync_cached_total
+    with query_cache_lock:
+        query_count = len(query_updated_at)
+        query_total = query_updated_total
 
-    with rate_lock:
-        active_ips = len(rate_limits)
+    # len() of each shard is atomic; no need to take the shard locks
+    active_ips = sum(map(len, rate_shards))
 
-    return jsonify({
+    return json_response({
         "sync_cache": {
             "count": sync_count,
             "ttl_seconds": SYNC_CACHE_TTL,
-            "avg_age_seconds": round(sum(sync_ages) / len(sync_ages), 1) if sync_ages else 0
+            "avg_age_seconds": round(mono_now - sync_total / sync_count, 1) if sync_count else 0
         },
         "query_cache": {
             "count": query_count,
             "ttl_seconds": QUERY_CACHE_TTL,
-            "avg_age_seconds": round(sum(query_ages) / len(query_ages), 1) if query_ages else 0
+            "avg_age_seconds": round(now - query_total / query_count, 1) if query_count else 0
         },
         "rate_limiting": {
             "active_ips": active_ips,
@@ -524,22 +990,39 @@ def edge_stats():
 @app.route("/edge/cache/clear", methods=["POST"])
 def clear_cache():
     """Clear all caches (requires tunnel auth)."""
-    # Authenticate
-    auth = request.authorization
-    expected_auth = os.environ.get("AUTH", "").split(":", 1)
+    global sync_cached_total, query_updated_total
 
-    if len(expected_auth) == 2:
-        if not auth or auth.username != expected_auth[0] or auth.password != expected_auth[1]:
-            return jsonify({"error": "unauthorized"}), 401
+    # Authenticate
+    if not check_edge_auth(request.authorization):
+        return json_response({"error": "unauthorized"}, 401)
 
-    with cache_lock:
+    with sync_cache_lock:
         sync_count = len(sync_cache)
-        query_count = len(query_cache)
         sync_cache.clear()
+        sync_cached_total = 0.0
+    with query_cache_lock:
+        query_count = len(query_cache)
         query_cache.clear()
-
-    logger.info(f"Cache cleared: sync={sync_count} query={query_count}")
-    return jsonify({"status": "cleared", "sync_cleared": sync_count, "query_cleared": query_count})
+        query_updated_at.clear()
+        query_updated_total = 0.0
+    with alexa_discovery_lock:
+        alexa_discovery_count = len(alexa_discovery_cache)
+        alexa_discovery_cache.clear()
+    with alexa_state_lock:
+        alexa_state_count = len(alexa_state_cache)
+        alexa_state_cache.clear()
+
+    logger.info(
+        f"Cache cleared: sync={sync_count} query={query_count} "
+        f"alexa_discovery={alexa_discovery_count} alexa_state={alexa_state_count}"
+    )
+    return json_response({
+        "status": "cleared",
+        "sync_cleared": sync_count,
+        "query_cleared": query_count,
+        "alexa_discovery_cleared": alexa_discovery_count,
+        "alexa_state_cleared": alexa_state_count
+    })
 
 
 # =============================================================================
@@ -556,62 +1039,63 @@ def remote_ui_toggle():
     The HA add-on calls POST on startup to sync the setting.
     """
     if request.method == "GET":
-        return jsonify({
+        return json_response({
             "enabled": remote_ui_settings["enabled"],
             "updated_at": remote_ui_settings["updated_at"]
         })
 
     # POST - authenticate first
-    auth = request.authorization
-    expected_auth = os.environ.get("AUTH", "").split(":", 1)
+    if not check_edge_auth(request.authorization):
+        return json_response({"error": "unauthorized"}, 401)
 
-    if len(expected_auth) == 2:
-        if not auth or auth.username != expected_auth[0] or auth.password != expected_auth[1]:
-            return jsonify({"error": "unauthorized"}), 401
-
-    data = request.get_json() or {}
+    data = parse_json_body()
+    if data is None:
+        return json_response({"error": "invalid_request"}, 400)
     enabled = bool(data.get("enabled", False))
 
     remote_ui_settings["enabled"] = enabled
     remote_ui_settings["updated_at"] = time.time()
 
     logger.info(f"Remote UI: {'enabled' if enabled else 'disabled'}")
-    return jsonify({
+    return json_response({
         "enabled": remote_ui_settings["enabled"],
         "updated_at": remote_ui_settings["updated_at"]
     })
 
 
-@app.route("/edge/remote-ui/check", methods=["GET"])
+# auth_request answers, built once and reused (see HEALTH_RESPONSE)
+REMOTE_UI_ALLOWED = Response("", 200)
+REMOTE_UI_DENIED = Response("Remote UI disabled", 403)
+
+
+@app.route("/edge/remote-ui/check", methods=["GET"], provide_automatic_options=False)
 def remote_ui_check():
     """Quick check for nginx auth_request.
 
     Returns 200 if UI access allowed, 403 if denied.
-    Always allows WebSocket upgrades (Chisel tunnel).
+    Always allows WebSocket upgrades (Chisel tunnel control channel).
 
     Called by nginx on every UI request via auth_request.
     """
-    # Always allow WebSocket (Chisel tunnel control channel)
-    if request.headers.get("X-Original-Upgrade", "").lower() == "websocket":
-        return "", 200
-
     if remote_ui_settings["enabled"]:
-        return "", 200
+        return REMOTE_UI_ALLOWED
 
-    return "Remote UI disabled", 403
+    # nginx omits the header entirely for plain requests (empty
+    # $http_upgrade), so the common case is a None check with no .lower()
+    upgrade = request.headers.get("X-Original-Upgrade")
+    if upgrade and (upgrade == "websocket" or upgrade.lower() == "websocket"):
+        return REMOTE_UI_ALLOWED
+    return REMOTE_UI_DENIED
 
 
 # =============================================================================
 # Health Check
 # =============================================================================
 
-@app.route("/health", methods=["GET"])
-def health():
-    """Health check endpoint.
-
-    Used by Cloud Run for liveness/readiness probes.
-    """
-    return jsonify({
+# Body never changes, so the response is built once and reused. Safe to
+# share: nothing downstream mutates it (no sessions, no after_request hooks).
+HEALTH_RESPONSE = Response(
+    orjson.dumps({
         "status": "healthy",
         "service": "ha-edge",
         "version": "2.2.0",
@@ -620,7 +1104,18 @@ def health():
             "butler": ["sync_cache", "query_cache", "offline_fallback", "webhooks", "logging"],
             "voice_assistants": ["google_assistant", "alexa"]
         }
-    })
+    }),
+    mimetype="application/json"
+)
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    """Health check endpoint.
+
+    Used by Cloud Run for liveness/readiness probes.
+    """
+    return HEALTH_RESPONSE
 
 
 # =============================================================================
@@ -628,10 +1123,24 @@ def health():
 # =============================================================================
 
 # Alexa caches (similar to Google)
-alexa_discovery_cache: dict[str, dict] = {}  # {user_id: {response, expires_at}}
-alexa_state_cache: dict[str, dict] = {}      # {endpoint_id: {state, updated_at}}
+alexa_discovery_cache: dict[str, CachedResponse] = {}  # {user_id: CachedResponse}
+alexa_state_cache: dict[str, AlexaState] = {}          # {endpoint_id: AlexaState}
+alexa_discovery_inflight: dict[str, Event] = {}  # {user_id: Event}, see sync_inflight
+alexa_discovery_lock = Lock()
+alexa_state_lock = Lock()
 
-ALEXA_DISCOVERY_TTL = int(os.environ.get("ALEXA_DISCOVERY_TTL", 300))  # 5 minutes
+# Fixed part of the offline-fallback StateReport header; the per-request
+# messageId and correlationToken are merged in
+ALEXA_STATE_REPORT_HEADER = {"namespace": "Alexa", "name": "StateReport", "payloadVersion": "3"}
+
+
+@lru_cache(maxsize=2048)
+def alexa_user_key(auth_header: str) -> str:
+    """Cache key for a bearer token (16 hex chars, never the token itself).
+
+    Memoized: Alexa resends the same token until it rotates.
+    """
+    return hashlib.blake2b(auth_header.encode(), digest_size=8).hexdigest()
 
 
 @app.route("/api/alexa", methods=["POST"])
@@ -646,15 +1155,14 @@ def alexa_smart_home():
 
     The Lambda proxy forwards requests from Alexa to this endpoint.
     We process them and forward to Home Assistant's alexa/smart_home endpoint.
+    Each (namespace, name) is dispatched to its handler via ALEXA_DIRECTIVE_HANDLERS.
     """
-    start_time = time.time()
-
-    # Parse request
-    data = request.get_json() or {}
+    start_time = time.monotonic_ns()
 
-    # Basic validation
-    if not validate_json_safe(data):
-        return jsonify({"error": "invalid_request"}), 400
+    # Parse request (size already capped by MAX_CONTENT_LENGTH)
+    data = parse_json_body()
+    if data is None:
+        return json_response({"error": "invalid_request"}, 400)
 
     # Extract directive info
     directive = data.get("directive", {})
@@ -665,118 +1173,156 @@ def alexa_smart_home():
     # For logging
     directive_type = f"{namespace}.{name}"
 
-    # -------------------------------------------------------------------------
-    # Alexa.Discovery: Return device list (cached)
-    # -------------------------------------------------------------------------
-    if namespace == "Alexa.Discovery" and name == "Discover":
-        # Use bearer token as user key
-        auth_header = request.headers.get("Authorization", "")
-        user_id = hashlib.sha256(auth_header.encode()).hexdigest()[:16]
+    handler = ALEXA_DIRECTIVE_HANDLERS.get((namespace, name), handle_alexa_directive)
+    return handler(directive_type, data, directive, header, start_time)
 
-        # Check cache first
-        with cache_lock:
-            cached = alexa_discovery_cache.get(user_id)
-            if cached and cached["expires_at"] > time.time():
-                logger.info(f"Alexa Discovery cache hit: user={user_id[:8]}...")
-                duration_ms = int((time.time() - start_time) * 1000)
-                log_request(directive_type, data, cached["response"], duration_ms, cached=True)
-                return jsonify(cached["response"])
-
-        # Forward to HA
-        response, status, is_error = proxy_to_upstream(
-            "/api/alexa/smart_home", data, request.headers
-        )
 
-        if not is_error and response:
-            # Cache the response
-            with cache_lock:
-                alexa_discovery_cache[user_id] = {
-                    "response": response,
-                    "expires_at": time.time() + ALEXA_DISCOVERY_TTL
-                }
-            endpoints = response.get("event", {}).get("payload", {}).get("endpoints", [])
-            logger.info(f"Alexa Discovery: cached {len(endpoints)} endpoints")
-            call_webhook("alexa_discovery", {"endpoint_count": len(endpoints)})
-
-        duration_ms = int((time.time() - start_time) * 1000)
+# -----------------------------------------------------------------------------
+# Alexa.Discovery: Return device list (cached)
+# -----------------------------------------------------------------------------
+
+def fetch_alexa_discovery(user_id: str, data: dict, headers) -> tuple[Optional[dict], int, Optional[CachedResponse]]:
+    """Forward Discover to HA and cache a good answer.
+
+    Returns (response, status, cache entry or None on error).
+    """
+    response, status, is_error = proxy_to_upstream("/api/alexa/smart_home", data, headers)
+    if is_error or not response:
+        return response, status, None
+
+    now = time.monotonic()
+    entry = make_cache_entry(response, now, ALEXA_DISCOVERY_TTL)
+    with alexa_discovery_lock:
+        alexa_discovery_cache.pop(user_id, None)
+        alexa_discovery_cache[user_id] = entry
+        trim_cache(alexa_discovery_cache, SYNC_CACHE_MAX, now)
+    endpoints = response.get("event", {}).get("payload", {}).get("endpoints", [])
+    logger.info(f"Alexa Discovery: cached {len(endpoints)} endpoints")
+    call_webhook("alexa_discovery", {"endpoint_count": len(endpoints)})
+    return response, status, entry
+
+
+def handle_alexa_discovery(directive_type: str, data: dict, directive: dict, header: dict, start_time: int):
+    # Use bearer token as user key
+    auth_header = request.headers.get("Authorization", "")
+    user_id = alexa_user_key(auth_header)
+
+    # Check cache first (as of request start); on a miss, wait out any
+    # fetch already in flight
+    now = start_time / 1e9
+    cached = alexa_discovery_cache.get(user_id)
+    if not (cached and cached.stale_until > now):
+        event, leader = join_inflight(alexa_discovery_inflight, user_id)
+        if not leader:
+            event.wait(SINGLEFLIGHT_TIMEOUT)
+            now = time.monotonic()
+            cached = alexa_discovery_cache.get(user_id)
+    if cached and cached.stale_until > now:
+        if cached.expires_at <= now:
+            # Stale: answer now, refresh for the next request
+            logger.info(f"Alexa Discovery cache hit (stale): user={user_id[:8]}...")
+            refresh_in_background(
+                alexa_discovery_inflight, user_id, fetch_alexa_discovery,
+                user_id, data, {"Authorization": auth_header}
+            )
+        else:
+            logger.info(f"Alexa Discovery cache hit: user={user_id[:8]}...")
+        duration_ms = elapsed_ms(start_time)
+        log_request(directive_type, data, cached.response, duration_ms, cached=True)
+        return cached_response(cached)
+
+    # Forward to HA
+    try:
+        response, status, entry = fetch_alexa_discovery(user_id, data, request.headers)
+    finally:
+        if leader:
+            finish_inflight(alexa_discovery_inflight, user_id, event)
+
+    duration_ms = elapsed_ms(start_time)
+    log_request(directive_type, data, response, duration_ms)
+
+    if entry is None:
+        return json_response({"error": "upstream_error"}, status)
+    return cached_response(entry)
+
+
+# -----------------------------------------------------------------------------
+# Alexa.ReportState: Return device state (cached for offline fallback)
+# -----------------------------------------------------------------------------
+
+def handle_alexa_report_state(directive_type: str, data: dict, directive: dict, header: dict, start_time: int):
+    endpoint = directive.get("endpoint", {})
+    endpoint_id = endpoint.get("endpointId", "unknown")
+
+    # Try upstream first
+    response, status, is_error = proxy_to_upstream(
+        "/api/alexa/smart_home", data, request.headers
+    )
+
+    if not is_error and response:
+        # Cache state for offline fallback
+        context = response.get("context", {})
+        properties = context.get("properties", [])
+        if properties:
+            with alexa_state_lock:
+                alexa_state_cache.pop(endpoint_id, None)
+                alexa_state_cache[endpoint_id] = AlexaState(properties, time.time())
+                trim_cache(alexa_state_cache, QUERY_CACHE_MAX)
+
+        duration_ms = elapsed_ms(start_time)
         log_request(directive_type, data, response, duration_ms)
+        return json_response(response)
+
+    # Offline fallback - return cached state
+    cached = alexa_state_cache.get(endpoint_id)
+    if cached:
+        logger.warning(f"Alexa offline fallback: endpoint={endpoint_id}")
+        fallback_response = {
+            "event": {
+                "header": {
+                    **ALEXA_STATE_REPORT_HEADER,
+                    "messageId": header.get("messageId", ""),
+                    "correlationToken": header.get("correlationToken", "")
+                },
+                "endpoint": endpoint,
+                "payload": {}
+            },
+            "context": {
+                "properties": cached.properties
+            }
+        }
+        duration_ms = elapsed_ms(start_time)
+        log_request(directive_type, data, fallback_response, duration_ms, offline=True)
+        call_webhook("alexa_offline_fallback", {"endpoint_id": endpoint_id})
+        return json_response(fallback_response)
 
-        if is_error or not response:
-            return jsonify({"error": "upstream_error"}), status
-        return jsonify(response)
+    return json_response({"error": "upstream_unavailable"}, status)
 
-    # -------------------------------------------------------------------------
-    # Alexa.ReportState: Return device state (cached for offline fallback)
-    # -------------------------------------------------------------------------
-    elif namespace == "Alexa" and name == "ReportState":
-        endpoint = directive.get("endpoint", {})
-        endpoint_id = endpoint.get("endpointId", "unknown")
 
-        # Try upstream first
-        response, status, is_error = proxy_to_upstream(
-            "/api/alexa/smart_home", data, request.headers
-        )
+# -----------------------------------------------------------------------------
+# All other directives (controllers): Forward to HA (never cached)
+# -----------------------------------------------------------------------------
 
-        if not is_error and response:
-            # Cache state for offline fallback
-            context = response.get("context", {})
-            properties = context.get("properties", [])
-            if properties:
-                with cache_lock:
-                    alexa_state_cache[endpoint_id] = {
-                        "properties": properties,
-                        "updated_at": time.time()
-                    }
-
-            duration_ms = int((time.time() - start_time) * 1000)
-            log_request(directive_type, data, response, duration_ms)
-            return jsonify(response)
-
-        # Offline fallback - return cached state
-        with cache_lock:
-            cached = alexa_state_cache.get(endpoint_id)
-            if cached:
-                logger.warning(f"Alexa offline fallback: endpoint={endpoint_id}")
-                fallback_response = {
-                    "event": {
-                        "header": {
-                            "namespace": "Alexa",
-                            "name": "StateReport",
-                            "messageId": header.get("messageId", ""),
-                            "correlationToken": header.get("correlationToken", ""),
-                            "payloadVersion": "3"
-                        },
-                        "endpoint": endpoint,
-                        "payload": {}
-                    },
-                    "context": {
-                        "properties": cached["properties"]
-                    }
-                }
-                duration_ms = int((time.time() - start_time) * 1000)
-                log_request(directive_type, data, fallback_response, duration_ms, offline=True)
-                call_webhook("alexa_offline_fallback", {"endpoint_id": endpoint_id})
-                return jsonify(fallback_response)
-
-        return jsonify({"error": "upstream_unavailable"}), status
-
-    # -------------------------------------------------------------------------
-    # All other directives (controllers): Forward to HA (never cached)
-    # -------------------------------------------------------------------------
-    else:
-        response, status, is_error = proxy_to_upstream(
-            "/api/alexa/smart_home", data, request.headers
-        )
+def handle_alexa_directive(directive_type: str, data: dict, directive: dict, header: dict, start_time: int):
+    response, status, is_error = proxy_to_upstream(
+        "/api/alexa/smart_home", data, request.headers
+    )
 
-        if response and namespace.endswith("Controller"):
-            call_webhook("alexa_execute", {"directive": directive_type})
+    if response and WEBHOOK_URL and header.get("namespace", "").endswith("Controller"):
+        call_webhook("alexa_execute", {"directive": directive_type})
 
-        duration_ms = int((time.time() - start_time) * 1000)
-        log_request(directive_type, data, response, duration_ms)
+    duration_ms = elapsed_ms(start_time)
+    log_request(directive_type, data, response, duration_ms)
+
+    if is_error:
+        return json_response({"error": "upstream_error"}, status)
+    return json_response(response)
 
-        if is_error:
-            return jsonify({"error": "upstream_error"}), status
-        return jsonify(response)
+
+ALEXA_DIRECTIVE_HANDLERS = {
+    ("Alexa.Discovery", "Discover"): handle_alexa_discovery,
+    ("Alexa", "ReportState"): handle_alexa_report_state,
+}
 
 
 # =============================================================================